@@ -1,15 +1,27 @@
 import sys
 import tkinter as tk
 from tkinter import messagebox, simpledialog
-from flask import Flask, render_template, jsonify, request, current_app
+from flask import Flask, Response, render_template, jsonify, request, current_app, send_from_directory, abort
 import threading
 import subprocess
 import os
 import re
 import glob
 import time
-import shutil
+import json
+import uuid
+import struct
+import ctypes
+import ctypes.util
+import fcntl
+import errno
+import signal
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+try:
+    from waitress import serve
+except ImportError:
+    serve = None # Falls back to Flask's built-in server
 
 # --- Configuration ---
 RAM_DISK_PATH = "/dev/shm/hls_buffer"  # Use shared memory as a RAM disk
@@ -17,91 +29,402 @@ VIDEO_SAVE_DIR = os.path.expanduser("~/Videos") # Save final videos here
 BUFFER_DURATION_SECONDS = 1800  # 30 minutes
 HLS_SEGMENT_DURATION = 4        # 4-second segments
 HLS_LIST_SIZE = BUFFER_DURATION_SECONDS // HLS_SEGMENT_DURATION # 450 segments
+CAPTURE_FRAMERATE = 30
+GOP_SIZE = HLS_SEGMENT_DURATION * CAPTURE_FRAMERATE # One keyframe per segment, so every segment starts with an IDR frame
+STATS_REFRESH_INTERVAL = 1 # Seconds between background stats refreshes
+MAX_SAVE_JOBS = 20 # Finished save jobs kept around for status queries
+HLS_ACCEL_REDIRECT_PREFIX = None # e.g. "/internal_hls/" to let an nginx internal location serve segments
+WEB_SERVER_THREADS = 8 # Each open status stream holds one of these
+ENCODER_CACHE_PATH = "/dev/shm/dvr_encoder" # Detected encoder, kept outside RAM_DISK_PATH so buffer cleanup doesn't remove it
+CONCAT_LIST_PATH = "/dev/shm/dvr_concat.txt" # Segment list for saves, also outside RAM_DISK_PATH so a restart can't unlink it mid-save
+
+# Matches USB sound cards in 'arecord -l' output. Works on the raw bytes, so the output is never decoded.
+_USB_CARD_RE = re.compile(rb"card (\d+):.*USB", re.IGNORECASE)
+# Same for /proc/asound/cards, e.g. " 1 [Device         ]: USB-Audio - USB PnP Sound Device"
+_PROC_USB_CARD_RE = re.compile(rb"^\s*(\d+) \[.*?\]: USB", re.IGNORECASE | re.MULTILINE)
+
+# V4L2 ioctls and structs from linux/videodev2.h, for checking cameras without running ffmpeg
+_V4L2_CAPABILITY = struct.Struct('16s32s32sIII12x') # driver, card, bus_info, version, capabilities, device_caps
+_V4L2_FRMSIZEENUM = struct.Struct('III6I8x') # index, pixel_format, type, discrete/stepwise sizes
+_VIDIOC_QUERYCAP = (2 << 30) | (_V4L2_CAPABILITY.size << 16) | (ord('V') << 8) | 0 # _IOR('V', 0, ...)
+_VIDIOC_ENUM_FRAMESIZES = (3 << 30) | (_V4L2_FRMSIZEENUM.size << 16) | (ord('V') << 8) | 74 # _IOWR('V', 74, ...)
+_V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+_V4L2_CAP_DEVICE_CAPS = 0x80000000
+_V4L2_FRMSIZE_TYPE_DISCRETE = 1
+_V4L2_PIX_FMT_YUYV = int.from_bytes(b'YUYV', 'little')
 
 class DeviceDetector:
     """Encapsulates the logic for finding active audio/video devices."""
+    def __init__(self):
+        self._probe_lock = threading.Lock()
+        self._probe_processes = {} # device -> running probe Popen, so losing probes can be killed
+
     def eprint(self, *args, **kwargs):
         print(f"[Detector] ", *args, file=sys.stderr, **kwargs)
 
+    def _video_probe_command(self, device, resolution):
+        return [
+            "ffmpeg", "-f", "v4l2", "-video_size", resolution, "-i", device,
+            "-t", "0.5", "-frames:v", "1", "-f", "null", "-", "-loglevel", "error"
+        ]
+
+    def _audio_probe_command(self, device_id):
+        return ["arecord", "-D", device_id, "-f", "S16_LE", "-r", "44100", "-d", "1", "/dev/null"]
+
+    def _run_probe(self, device, command, cancelled=None):
+        """Runs a probe command to completion and returns True if it succeeded."""
+        if cancelled is not None and cancelled.is_set():
+            return False
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            return False
+        with self._probe_lock:
+            self._probe_processes[device] = process
+        # Another probe may have won while this one was being launched
+        if cancelled is not None and cancelled.is_set():
+            process.kill()
+        try:
+            return process.wait() == 0
+        finally:
+            with self._probe_lock:
+                self._probe_processes.pop(device, None)
+
+    def _first_successful_probe(self, commands):
+        """Probes all devices at once and returns the first one that passes, killing the rest."""
+        if not commands:
+            return None
+        cancelled = threading.Event()
+        with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+            futures = {executor.submit(self._run_probe, device, command, cancelled): device
+                       for device, command in commands.items()}
+            for future in as_completed(futures):
+                device = futures[future]
+                if future.result():
+                    cancelled.set()
+                    for other in futures:
+                        other.cancel()
+                    with self._probe_lock:
+                        for other_device, process in self._probe_processes.items():
+                            if other_device != device:
+                                process.kill()
+                    return device
+                self.eprint(f"{device} failed test.")
+        return None
+
+    def _query_v4l2(self, device, resolution):
+        """Asks the driver if the device can capture YUYV at the resolution, without capturing anything.
+
+        Returns True or False, or None if the device couldn't be queried and ffmpeg has to decide.
+        """
+        try:
+            width, height = (int(v) for v in resolution.split('x'))
+            fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+        except (ValueError, OSError):
+            return None
+        try:
+            caps = bytearray(_V4L2_CAPABILITY.size)
+            fcntl.ioctl(fd, _VIDIOC_QUERYCAP, caps)
+            _, _, _, _, capabilities, device_caps = _V4L2_CAPABILITY.unpack(caps)
+            if capabilities & _V4L2_CAP_DEVICE_CAPS:
+                capabilities = device_caps # Capabilities of this node rather than the whole device
+            if not capabilities & _V4L2_CAP_VIDEO_CAPTURE:
+                return False
+            
+            index = 0
+            while True:
+                frmsize = bytearray(_V4L2_FRMSIZEENUM.pack(index, _V4L2_PIX_FMT_YUYV, 0, 0, 0, 0, 0, 0, 0))
+                try:
+                    fcntl.ioctl(fd, _VIDIOC_ENUM_FRAMESIZES, frmsize)
+                except OSError as e:
+                    if e.errno == errno.EINVAL:
+                        return False # End of the list, or YUYV isn't supported at all
+                    raise
+                _, _, size_type, *sizes = _V4L2_FRMSIZEENUM.unpack(frmsize)
+                if size_type == _V4L2_FRMSIZE_TYPE_DISCRETE:
+                    if sizes[0] == width and sizes[1] == height:
+                        return True
+                    index += 1
+                    continue
+                # Stepwise and continuous ranges are reported as a single entry
+                min_w, max_w, step_w, min_h, max_h, step_h = sizes
+                return (min_w <= width <= max_w and (width - min_w) % max(step_w, 1) == 0 and
+                        min_h <= height <= max_h and (height - min_h) % max(step_h, 1) == 0)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def verify_device(self, device, resolution):
+        """Checks a single video device at the given resolution, falling back to capturing one frame."""
+        supported = self._query_v4l2(device, resolution)
+        if supported is not None:
+            return supported
+        return self._run_probe(device, self._video_probe_command(device, resolution))
+
+    def verify_audio_device(self, device_id):
+        """Checks a single ALSA device by recording a one second clip."""
+        return self._run_probe(device_id, self._audio_probe_command(device_id))
+
     def find_active_video_device(self, resolution):
         potential_devices = sorted(glob.glob('/dev/video*'))
+        self.eprint(f"Testing video devices {potential_devices} at {resolution}...")
+        unknown_devices = []
         for device in potential_devices:
-            self.eprint(f"Testing video device: {device} at {resolution}...")
-            command = [
-                "ffmpeg", "-f", "v4l2", "-video_size", resolution, "-i", device,
-                "-t", "0.5", "-frames:v", "1", "-f", "null", "-", "-loglevel", "error"
-            ]
-            try:
-                subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            supported = self._query_v4l2(device, resolution)
+            if supported:
                 self.eprint(f"Success! Active video device found: {device}")
                 return device
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                self.eprint(f"{device} failed test or is not a capture device.")
-                continue
+            if supported is None:
+                unknown_devices.append(device)
+        # Only devices the driver couldn't answer for are tested with ffmpeg
+        device = self._first_successful_probe(
+            {device: self._video_probe_command(device, resolution) for device in unknown_devices})
+        if device:
+            self.eprint(f"Success! Active video device found: {device}")
+            return device
         self.eprint("Warning: No active video device found.")
         return None
 
+    def _list_usb_capture_cards(self):
+        """Returns the card numbers of USB sound cards that can record."""
+        try:
+            with open('/proc/asound/cards', 'rb') as f:
+                cards = _PROC_USB_CARD_RE.findall(f.read())
+            return [card for card in cards if os.path.exists(f"/proc/asound/card{card.decode()}/pcm0c")]
+        except OSError:
+            # No procfs sound info, ask arecord instead
+            output = subprocess.check_output(["arecord", "-l"], stderr=subprocess.DEVNULL)
+            return _USB_CARD_RE.findall(output)
+
     def find_active_audio_device(self):
         try:
-            output = subprocess.check_output(["arecord", "-l"], stderr=subprocess.DEVNULL).decode("utf-8")
-            usb_devices = re.findall(r"card (\d+):.*USB", output, re.IGNORECASE)
-            for card_num in usb_devices:
-                device_id = f"plughw:{card_num},0"
-                self.eprint(f"Testing audio device: {device_id}...")
-                command = ["arecord", "-D", device_id, "-f", "S16_LE", "-r", "44100", "-d", "1", "/dev/null"]
-                try:
-                    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    self.eprint(f"Success! Active audio device found: {device_id}")
-                    return device_id
-                except (subprocess.CalledProcessError, FileNotFoundError):
-                    self.eprint(f"{device_id} is not an active audio input.")
-                    continue
+            usb_devices = self._list_usb_capture_cards()
+            device_ids = [f"plughw:{card_num.decode()},0" for card_num in usb_devices]
+            self.eprint(f"Testing audio devices {device_ids}...")
+            device_id = self._first_successful_probe(
+                {device_id: self._audio_probe_command(device_id) for device_id in device_ids})
+            if device_id:
+                self.eprint(f"Success! Active audio device found: {device_id}")
+                return device_id
         except (subprocess.CalledProcessError, FileNotFoundError):
             self.eprint("Error: 'arecord' command not found or failed.")
         self.eprint("Warning: No active USB audio device found.")
         return None
 
+class SegmentWatcher:
+    """Keeps a running count and size of the HLS segments in RAM_DISK_PATH using inotify.
+
+    The segment set only changes every few seconds, so this is much cheaper than scanning the
+    directory for every stats refresh. Falls back to a scan whenever inotify isn't usable.
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sizes = {} # segment name -> size in bytes
+        self._total_size = 0
+        self._active = False
+        self._fd = None
+        self._wd = None
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            self._libc = None
+
+    def scan(self):
+        """Returns {segment name: size} straight from the directory."""
+        sizes = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.ts'):
+                        try:
+                            sizes[entry.name] = entry.stat(follow_symlinks=False).st_size
+                        except FileNotFoundError:
+                            continue # Rotated out by ffmpeg while scanning
+        except FileNotFoundError:
+            pass
+        return sizes
+
+    def start(self):
+        """Starts watching, unless already doing so. Safe to call on every capture start."""
+        with self._lock:
+            if self._active or self._libc is None:
+                return
+            if self._fd is None:
+                fd = self._libc.inotify_init1(os.O_CLOEXEC)
+                if fd < 0:
+                    print(f"[Watcher] WARN: inotify unavailable ({os.strerror(ctypes.get_errno())}), scanning instead.")
+                    self._libc = None
+                    return
+                self._fd = fd
+                threading.Thread(target=self._read_loop, daemon=True).start()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(self.path), self.WATCH_MASK)
+            if wd < 0:
+                print(f"[Watcher] WARN: Could not watch {self.path} ({os.strerror(ctypes.get_errno())}), scanning instead.")
+                return
+            self._wd = wd
+            self._reset()
+            self._active = True
+
+    def _reset(self):
+        # Seed from the directory once; caller holds the lock
+        self._sizes = self.scan()
+        self._total_size = sum(self._sizes.values())
+
+    def segment_names(self):
+        """Returns the buffered segment names, oldest first."""
+        with self._lock:
+            if self._active:
+                return sorted(self._sizes)
+        return sorted(self.scan())
+
+    def totals(self):
+        """Returns (segment count, total bytes)."""
+        with self._lock:
+            if self._active:
+                return len(self._sizes), self._total_size
+        sizes = self.scan()
+        return len(sizes), sum(sizes.values())
+
+    def _read_loop(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError as e:
+                print(f"[Watcher] ERROR: inotify read failed: {e}")
+                with self._lock:
+                    self._active = False
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b'\0').decode(errors='ignore')
+                offset += name_len
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        with self._lock:
+            if mask & self.IN_Q_OVERFLOW:
+                self._reset() # Events were lost, start over from the directory
+            elif wd != self._wd:
+                pass # Left over from a directory that was replaced
+            elif mask & (self.IN_DELETE_SELF | self.IN_IGNORED):
+                self._active = False # Directory is gone; start() will watch it again
+            elif not name.endswith('.ts'):
+                pass
+            elif mask & (self.IN_MOVED_TO | self.IN_CLOSE_WRITE):
+                try:
+                    size = os.stat(os.path.join(self.path, name)).st_size
+                except FileNotFoundError:
+                    return
+                self._total_size += size - self._sizes.get(name, 0)
+                self._sizes[name] = size
+            elif mask & (self.IN_MOVED_FROM | self.IN_DELETE):
+                self._total_size -= self._sizes.pop(name, 0)
+
 class CaptureManager:
     """Manages the ffmpeg process and application state in a thread-safe way."""
     def __init__(self):
         self.detector = DeviceDetector()
+        self.segment_watcher = SegmentWatcher(RAM_DISK_PATH)
         self.lock = threading.Lock()
         self.ffmpeg_process = None
         self.status = "Stopped"
         self.capture_thread = None
         self.is_running = False
+        self.stop_event = threading.Event() # Set by stop_capture to wake the capture loop early
         self.start_time = None
         self.resolution = "640x480"
         self.last_video_device = None
         self.last_audio_device = None
+        self._encoder_cache = None
+        self._save_executor = ThreadPoolExecutor(max_workers=1) # One remux at a time, in the background
+        self._save_jobs = {} # job id -> Future, oldest first
         
         # Prepare directories
         os.makedirs(RAM_DISK_PATH, exist_ok=True)
         os.makedirs(VIDEO_SAVE_DIR, exist_ok=True)
+        
+        # Stats are collected by one background thread and shared by the GUI and all web clients
+        self._stats_lock = threading.Lock()
+        self._stats_cache = self._collect_stats()
+        self._stats_listeners = [] # Called from the refresh thread whenever the snapshot changes
+        self._stats_thread = threading.Thread(target=self._stats_refresh_loop, daemon=True)
+        self._stats_thread.start()
 
     def _get_encoder(self):
-        """Check for hardware encoders and fall back to software."""
-        encoders_output = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
-        if 'h264_v4l2m2m' in encoders_output:
-            return 'h264_v4l2m2m'
-        if 'h264_omx' in encoders_output:
-            return 'h264_omx'
-        print("[Manager] WARN: No hardware encoder found, falling back to libx264 (slow).")
-        return 'libx264'
+        """Check for hardware encoders and fall back to software. The result is cached, as it can't change before a reboot."""
+        if self._encoder_cache:
+            return self._encoder_cache
+        
+        # A previous run during this boot may already have probed the encoders
+        try:
+            with open(ENCODER_CACHE_PATH) as f:
+                self._encoder_cache = f.read().strip()
+            if self._encoder_cache:
+                return self._encoder_cache
+        except OSError:
+            pass
+        
+        encoder = 'libx264'
+        for candidate in ('h264_v4l2m2m', 'h264_omx'):
+            # Asking for help on a single encoder is much faster than dumping the full encoder list
+            probe = subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'quiet', '-h', f'encoder={candidate}'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            # Older ffmpeg versions exit with 0 even for unknown encoders, so also check the help text
+            if probe.returncode == 0 and probe.stdout.startswith(b'Encoder '):
+                encoder = candidate
+                break
+        if encoder == 'libx264':
+            print("[Manager] WARN: No hardware encoder found, falling back to libx264 (slow).")
+        
+        self._encoder_cache = encoder
+        try:
+            with open(ENCODER_CACHE_PATH, 'w') as f:
+                f.write(encoder)
+        except OSError as e:
+            print(f"[Manager] WARN: Could not cache encoder choice: {e}")
+        return encoder
 
     def _capture_loop(self):
         while self.is_running:
             with self.lock:
                 current_resolution = self.resolution
                 self.status = "Detecting devices..."
+                cached_video_device = self.last_video_device
+                cached_audio_device = self.last_audio_device
             
-            video_device = self.detector.find_active_video_device(current_resolution)
-            audio_device = self.detector.find_active_audio_device()
+            # Try the devices that worked last time before scanning everything again
+            if cached_video_device and os.path.exists(cached_video_device) \
+                    and self.detector.verify_device(cached_video_device, current_resolution):
+                video_device = cached_video_device
+            else:
+                video_device = self.detector.find_active_video_device(current_resolution)
+            
+            if cached_audio_device and self.detector.verify_audio_device(cached_audio_device):
+                audio_device = cached_audio_device
+            else:
+                audio_device = self.detector.find_active_audio_device()
 
             if not video_device or not audio_device:
                 with self.lock:
+                    self.last_video_device = video_device
+                    self.last_audio_device = audio_device
                     self.status = "Devices not found. Retrying..."
-                time.sleep(5)
+                self.stop_event.wait(5)
                 continue
             
             with self.lock:
@@ -109,73 +432,118 @@ class CaptureManager:
                 self.last_audio_device = audio_device
                 self.status = "Starting ffmpeg..."
             
-            # Clean up old buffer before starting
-            if os.path.exists(RAM_DISK_PATH):
-                shutil.rmtree(RAM_DISK_PATH)
-            os.makedirs(RAM_DISK_PATH, exist_ok=True)
+            # Clean up old buffer before starting. The directory only holds flat files, so unlink
+            # them in place and keep the directory itself instead of removing and recreating it.
+            try:
+                with os.scandir(RAM_DISK_PATH) as entries:
+                    for entry in entries:
+                        try:
+                            os.unlink(entry.path)
+                        except OSError:
+                            pass
+            except FileNotFoundError:
+                os.makedirs(RAM_DISK_PATH, exist_ok=True)
+            self.segment_watcher.start()
 
             encoder = self._get_encoder()
             
             command = [
-                'ffmpeg', '-nostdin',
-                '-f', 'v4l2', '-input_format', 'yuyv422', '-video_size', current_resolution, '-framerate', '30', '-i', video_device,
+                'ffmpeg', '-nostdin', '-nostats', # No progress lines, stderr only carries real messages
+                '-loglevel', 'warning', # Skip the per-segment "Opening ... for writing" info lines _drain_stderr would log
+                '-fflags', '+nobuffer', '-rtbufsize', '16M', # Don't hold live input frames in the demuxer
+                '-f', 'v4l2', '-input_format', 'yuyv422', '-video_size', current_resolution, '-framerate', str(CAPTURE_FRAMERATE), '-i', video_device,
                 '-f', 'alsa', '-ac', '1', '-ar', '44100', '-i', audio_device,
                 '-c:v', encoder, 
                 '-b:v', '1M', 
                 '-preset', 'ultrafast' if encoder == 'libx264' else 'fast', # Ultrafast for software encoding
-                '-g', '60',
+                *(['-tune', 'zerolatency'] if encoder == 'libx264' else []),
+                '-g', str(GOP_SIZE), '-keyint_min', str(GOP_SIZE), '-sc_threshold', '0', '-bf', '0',
                 '-c:a', 'aac', '-b:a', '128k',
+                '-flush_packets', '0', '-muxdelay', '0', '-muxpreload', '0', # Let the muxer write in full buffers
                 '-f', 'hls',
                 '-hls_time', str(HLS_SEGMENT_DURATION),
                 '-hls_list_size', str(HLS_LIST_SIZE),
-                '-hls_flags', 'delete_segments',
+                # temp_file writes each segment as .ts.tmp and renames it when complete, so
+                # readers of RAM_DISK_PATH never see a partially written segment
+                '-hls_flags', 'delete_segments+temp_file+independent_segments',
                 '-hls_segment_filename', os.path.join(RAM_DISK_PATH, 'segment%06d.ts'),
                 os.path.join(RAM_DISK_PATH, 'playlist.m3u8')
             ]
             
             print(f"[Manager] Starting ffmpeg with command: {' '.join(command)}")
-            self.ffmpeg_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Nothing reads ffmpeg's stdout, and this process holds no fds that ffmpeg must not inherit,
+            # so skip the stdout pipe and the close_fds sweep. A new session keeps signals aimed at our
+            # process group (e.g. Ctrl+C) from killing ffmpeg mid-segment; the __main__ block always
+            # ends it through stop_capture(wait=True) instead.
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                       close_fds=False, start_new_session=True)
+            threading.Thread(target=self._drain_stderr, args=(process,), daemon=True).start()
             with self.lock:
+                self.ffmpeg_process = process
                 self.status = f"Recording at {current_resolution}"
                 self.start_time = time.time()
             
-            # Monitor the process
-            stdout, stderr = self.ffmpeg_process.communicate()
-            if self.is_running: # If it exited unexpectedly
-                print(f"[Manager] ERROR: ffmpeg exited unexpectedly. Code: {self.ffmpeg_process.returncode}")
-                print(f"[Manager] FFMPEG STDERR:\n{stderr.decode(errors='ignore')}")
+            # Monitor the process, waking up straight away if a stop is requested
+            while self.is_running and process.poll() is None:
+                self.stop_event.wait(0.5)
+            
+            if process.poll() is None: # Stopped while ffmpeg is still running
+                process.terminate()
+                try:
+                    process.wait(timeout=3)
+                except subprocess.TimeoutExpired:
+                    print("[Manager] ffmpeg did not exit in time, killing it.")
+                    process.kill()
+                    process.wait()
+            elif self.is_running: # If it exited unexpectedly
+                print(f"[Manager] ERROR: ffmpeg exited unexpectedly. Code: {process.returncode}")
                 with self.lock:
                     self.status = "ffmpeg crashed. Restarting..."
-                time.sleep(5)
+                self.stop_event.wait(5)
         
         with self.lock:
             self.status = "Stopped"
         print("[Manager] Capture loop has terminated.")
 
+    def _drain_stderr(self, process):
+        """Logs ffmpeg's stderr as it arrives, so it is never buffered up in memory."""
+        for line in iter(process.stderr.readline, b''):
+            print(f"[ffmpeg] {line.decode(errors='ignore').rstrip()}")
+        process.stderr.close()
+
     def start_capture(self):
         with self.lock:
             if self.is_running:
                 print("[Manager] Capture is already running.")
                 return
             self.is_running = True
+            self.stop_event.clear()
             self.status = "Starting..."
             self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
             self.capture_thread.start()
             print("[Manager] Capture thread started.")
 
-    def stop_capture(self):
+    def stop_capture(self, wait=False):
+        """Stops capturing. With wait=True, also blocks until the capture thread has reaped ffmpeg."""
         with self.lock:
-            if not self.is_running:
-                print("[Manager] Capture is not running.")
-                return
-            self.is_running = False # Signal the loop to stop
-            if self.ffmpeg_process:
-                print("[Manager] Terminating ffmpeg process...")
-                self.ffmpeg_process.terminate() # Ask ffmpeg to stop gracefully
-            self.ffmpeg_process = None
-            self.start_time = None
-        print("[Manager] Stop signal sent to capture thread.")
-        # The thread will exit on its own after the process is terminated
+            # Taken before the early return: an earlier stop may have left the thread still reaping ffmpeg
+            capture_thread = self.capture_thread
+            was_running = self.is_running
+            if was_running:
+                self.is_running = False # Signal the loop to stop
+                self.stop_event.set()
+                if self.ffmpeg_process:
+                    print("[Manager] Terminating ffmpeg process...")
+                    self.ffmpeg_process.terminate() # Ask ffmpeg to stop gracefully
+                self.ffmpeg_process = None
+                self.start_time = None
+        if was_running:
+            print("[Manager] Stop signal sent to capture thread.")
+            # The thread will exit on its own after the process is terminated
+        else:
+            print("[Manager] Capture is not running.")
+        if wait and capture_thread:
+            capture_thread.join(timeout=10) # The loop kills ffmpeg if it ignores the terminate
 
     def restart_capture(self):
         print("[Manager] Restarting capture...")
@@ -188,7 +556,40 @@ class CaptureManager:
             self.resolution = new_resolution
         self.restart_capture()
 
+    def _stats_refresh_loop(self):
+        while True:
+            time.sleep(STATS_REFRESH_INTERVAL)
+            try:
+                stats = self._collect_stats()
+            except Exception as e:
+                print(f"[Manager] ERROR: Failed to collect stats: {e}")
+                continue
+            with self._stats_lock:
+                changed = stats != self._stats_cache
+                self._stats_cache = stats
+            if changed:
+                for listener in list(self._stats_listeners):
+                    try:
+                        listener()
+                    except Exception as e:
+                        print(f"[Manager] ERROR: Stats listener failed: {e}")
+
+    def add_stats_listener(self, callback):
+        """Registers a callback that is run (on the stats thread) each time the stats change."""
+        self._stats_listeners.append(callback)
+
+    def remove_stats_listener(self, callback):
+        try:
+            self._stats_listeners.remove(callback)
+        except ValueError:
+            pass
+
     def get_stats(self):
+        """Returns the latest stats snapshot without doing any I/O."""
+        with self._stats_lock:
+            return dict(self._stats_cache)
+
+    def _collect_stats(self):
         with self.lock:
             stats = {
                 "status": self.status,
@@ -200,59 +601,106 @@ class CaptureManager:
                 "max_segments": HLS_LIST_SIZE
             }
             if self.is_running and self.start_time:
-                stats["uptime"] = time.time() - self.start_time
-            
-            # Get buffer size
-            if os.path.exists(RAM_DISK_PATH):
-                total_size = 0
-                ts_files = glob.glob(os.path.join(RAM_DISK_PATH, '*.ts'))
-                stats["buffered_segments"] = len(ts_files)
-                for f in ts_files:
-                    total_size += os.path.getsize(f)
-                stats["buffer_size_mb"] = total_size / (1024 * 1024)
-            
-            # Get free RAM
-            mem_info = os.popen('free -m').read()
-            stats["free_ram_mb"] = int(re.search(r'Mem:\s+\d+\s+\d+\s+(\d+)', mem_info).group(1))
-            return stats
+                stats["uptime"] = int(time.time() - self.start_time) # Whole seconds, so it changes at most once per refresh
+        
+        # Get buffer size. Only the state above needs the lock.
+        segment_count, total_size = self.segment_watcher.totals()
+        stats["buffered_segments"] = segment_count
+        stats["buffer_size_mb"] = total_size / (1024 * 1024)
+        
+        # Get free RAM. MemAvailable also counts reclaimable cache, which is what matters for the buffer.
+        with open('/proc/meminfo', 'rb') as f:
+            mem_info = f.read()
+        start = mem_info.find(b'MemAvailable:')
+        if start != -1:
+            end = mem_info.find(b'\n', start)
+            stats["free_ram_mb"] = int(mem_info[start + len(b'MemAvailable:'):end].split()[0]) // 1024
+        return stats
 
     def save_to_disk(self):
+        """Queues a save of the current buffer and returns straight away with a job id."""
         with self.lock:
             if not self.is_running:
                 return {"status": "error", "message": "Capture is not running."}
             self.status = "Saving video..."
         
-        playlist_path = os.path.join(RAM_DISK_PATH, 'playlist.m3u8')
-        if not os.path.exists(playlist_path):
+        if not self.segment_watcher.totals()[0]:
             with self.lock:
                 self.status = f"Recording at {self.resolution}" # Revert status
-            return {"status": "error", "message": "Playlist file not found."}
+            return {"status": "error", "message": "No buffered segments found."}
         
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         output_filename = os.path.join(VIDEO_SAVE_DIR, f"recording_{timestamp}.mp4")
         
-        # Use ffmpeg to concatenate HLS segments into a single MP4. This is the most reliable way.
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._save_jobs[job_id] = self._save_executor.submit(self._save_job, output_filename)
+            # Forget the oldest finished jobs so the table doesn't grow forever
+            finished = [i for i, f in self._save_jobs.items() if f.done()]
+            for old_id in finished[:max(0, len(self._save_jobs) - MAX_SAVE_JOBS)]:
+                del self._save_jobs[old_id]
+        return {"status": "accepted", "job_id": job_id, "message": "Saving video..."}
+
+    def get_save_job(self, job_id):
+        """Returns the state of a save job, or None if the id is unknown."""
+        with self.lock:
+            future = self._save_jobs.get(job_id)
+        if future is None:
+            return None
+        if not future.done():
+            return {"status": "pending", "job_id": job_id, "message": "Saving video..."}
+        if future.exception() is not None: # _save_job reports failures itself; this is only a safety net
+            return {"status": "error", "job_id": job_id, "message": "Failed to save video."}
+        return dict(future.result(), job_id=job_id)
+
+    def _save_job(self, output_filename):
+        try:
+            return self._remux_buffer(output_filename)
+        except OSError as e: # e.g. the buffer directory vanished, or the output disk is full
+            print(f"[Manager] ERROR: Save failed: {e}")
+            return {"status": "error", "message": "Failed to save video."}
+        finally:
+            with self.lock:
+                # This job's future isn't done yet, so it is the only pending one if the count is 1
+                pending = sum(not future.done() for future in self._save_jobs.values())
+                if pending <= 1 and self.status == "Saving video...":
+                    self.status = f"Recording at {self.resolution}" # Revert status
+
+    def _remux_buffer(self, output_filename):
+        # List the finished segments in order for ffmpeg's concat demuxer. This is a single linear
+        # read of the segments, without ffmpeg having to parse the playlist and rebuild its timing.
+        # Segments still being written are .ts.tmp files, so they are never part of the list.
+        # Saves run one at a time on _save_executor, so a single list file is enough
+        concat_list_path = CONCAT_LIST_PATH
+        with open(concat_list_path, 'w') as f:
+            f.writelines(f"file '{os.path.join(RAM_DISK_PATH, name)}'\n" for name in self.segment_watcher.segment_names())
+        
         save_command = [
             'ffmpeg', '-y',
-            '-i', playlist_path,
+            '-f', 'concat', '-safe', '0', '-i', concat_list_path,
             '-c', 'copy', # Copy streams without re-encoding
-            '-absf', 'aac_adtstoasc', # Important filter for AAC in MP4 container
+            '-bsf:a', 'aac_adtstoasc', # Important filter for AAC in MP4 container
             output_filename
         ]
         
         print(f"[Manager] Saving video with command: {' '.join(save_command)}")
         try:
-            process = subprocess.run(save_command, check=True, capture_output=True, text=True)
+            # stderr stays as bytes and is only decoded if it actually gets printed
+            subprocess.run(save_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
             print(f"[Manager] Save successful: {output_filename}")
-            result = {"status": "success", "message": f"Saved to {output_filename}"}
+            return {"status": "success", "message": f"Saved to {output_filename}"}
         except subprocess.CalledProcessError as e:
             print(f"[Manager] ERROR: Save failed. Code: {e.returncode}")
-            print(f"[Manager] Save FFMPEG STDERR:\n{e.stderr}")
-            result = {"status": "error", "message": "Failed to save video."}
-        
-        with self.lock:
-            self.status = f"Recording at {self.resolution}" # Revert status
-        return result
+            print(f"[Manager] Save FFMPEG STDERR:\n{e.stderr.decode(errors='ignore')}")
+            return {"status": "error", "message": "Failed to save video."}
+        except FileNotFoundError:
+            print("[Manager] ERROR: Save failed, ffmpeg not found.")
+            return {"status": "error", "message": "Failed to save video."}
+        finally:
+            try:
+                os.unlink(concat_list_path)
+            except FileNotFoundError:
+                pass
 
 # --- Flask Web Server ---
 app = Flask(__name__)
@@ -266,10 +714,42 @@ def api_status():
     manager = current_app.config['manager']
     return jsonify(manager.get_stats())
 
+@app.route("/api/status/stream")
+def api_status_stream():
+    """Pushes the stats snapshot to the browser once per refresh instead of having it poll."""
+    manager = current_app.config['manager']
+    def generate():
+        while True:
+            yield f"data: {json.dumps(manager.get_stats())}\n\n"
+            time.sleep(STATS_REFRESH_INTERVAL)
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+HLS_MIMETYPES = {".m3u8": "application/vnd.apple.mpegurl", ".ts": "video/mp2t"}
+
+@app.route("/hls/<path:fn>")
+def hls(fn):
+    """Serves the live playlist and segments straight from the RAM disk."""
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(fn)[1])
+    if mimetype is None or os.path.basename(fn) != fn:
+        abort(404)
+    if HLS_ACCEL_REDIRECT_PREFIX:
+        # Behind nginx, hand the file back to it so Python never touches the video bytes
+        return Response(headers={"X-Accel-Redirect": HLS_ACCEL_REDIRECT_PREFIX + fn, "Content-Type": mimetype})
+    # Lets the WSGI server send the file with sendfile(2) instead of copying it through Python
+    return send_from_directory(RAM_DISK_PATH, fn, mimetype=mimetype, conditional=True, max_age=0)
+
 @app.route("/api/save")
 def api_save():
     manager = current_app.config['manager']
     result = manager.save_to_disk()
+    return jsonify(result), 202 if result["status"] == "accepted" else 200
+
+@app.route("/api/save/<job_id>")
+def api_save_status(job_id):
+    manager = current_app.config['manager']
+    result = manager.get_save_job(job_id)
+    if result is None:
+        return jsonify({"status": "error", "message": "Unknown save job."}), 404
     return jsonify(result)
 
 @app.route("/api/restart")
@@ -288,14 +768,19 @@ def api_reboot():
     os.system("sudo reboot")
     return jsonify({"status": "success", "message": "Reboot command sent."})
     
+_ALLOWED_RES = frozenset({"640x480", "320x240", "160x120"}) # Add more valid resolutions if needed
+
 @app.route("/api/change_resolution", methods=['POST'])
 def api_change_resolution():
     res = request.json.get('resolution')
-    if res in ["640x480", "320x240", "160x120"]: # Add more valid resolutions if needed
-        manager = current_app.config['manager']
-        manager.change_resolution(res)
-        return jsonify({"status": "success", "message": f"Changing resolution to {res} and restarting capture..."})
-    return jsonify({"status": "error", "message": "Invalid resolution."}), 400
+    if res not in _ALLOWED_RES:
+        return jsonify({"status": "error", "message": "Invalid resolution."}), 400
+    manager = current_app.config['manager']
+    if res == manager.resolution:
+        # A restart would throw away the whole buffer for nothing
+        return jsonify({"status": "noop", "message": f"Already recording at {res}."})
+    manager.change_resolution(res)
+    return jsonify({"status": "success", "message": f"Changing resolution to {res} and restarting capture..."})
 
 
 # --- Tkinter GUI ---
@@ -329,15 +814,22 @@ class AppGUI:
         self.stop_button = tk.Button(control_frame, text="Stop Program", command=self.stop_program, bg="salmon")
         self.stop_button.pack(fill=tk.X, pady=5)
 
-        self.update_stats()
+        # Redraw only when the manager reports new stats, instead of waking up on a timer
+        self.root.bind('<<StatsUpdated>>', self._redraw_stats)
+        self._stats_listener = lambda: self.root.event_generate('<<StatsUpdated>>', when='tail')
+        self.manager.add_stats_listener(self._stats_listener)
+        self._redraw_stats()
 
-    def update_stats(self):
+    def detach(self):
+        """Stops stats updates; event_generate fails once mainloop() has returned."""
+        self.manager.remove_stats_listener(self._stats_listener)
+
+    def _redraw_stats(self, event=None):
         stats = self.manager.get_stats()
         self.status_label.config(text=f"Status: {stats['status']}")
         self.uptime_label.config(text=f"Uptime: {int(stats['uptime'])}s")
         self.buffer_label.config(text=f"Buffer: {stats['buffered_segments']}/{stats['max_segments']} segments ({stats['buffer_size_mb']:.2f} MB)")
         self.ram_label.config(text=f"Free RAM: {stats['free_ram_mb']} MB")
-        self.root.after(1000, self.update_stats) # Update every second
 
     def toggle_pause(self):
         with self.manager.lock:
@@ -351,8 +843,8 @@ class AppGUI:
                     self.pause_button.config(text="Pause Recording")
 
     def save_video(self):
-        # No confirmation for save
-        threading.Thread(target=self.manager.save_to_disk, daemon=True).start()
+        # No confirmation for save. The save itself runs on the manager's background worker.
+        self.manager.save_to_disk()
 
     def stop_program(self):
         if messagebox.askyesno("Confirm", "Are you sure you want to stop the entire application?"):
@@ -366,10 +858,12 @@ if __name__ == "__main__":
     
     # 2. Configure and start Flask server in a daemon thread
     app.config['manager'] = capture_manager
-    flask_thread = threading.Thread(
-        target=lambda: app.run(host='0.0.0.0', port=5000, debug=False),
-        daemon=True
-    )
+    if serve:
+        web_server = lambda: serve(app, host='0.0.0.0', port=5000, threads=WEB_SERVER_THREADS)
+    else:
+        print("[Main] WARN: waitress is not installed, using Flask's development server.")
+        web_server = lambda: app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
+    flask_thread = threading.Thread(target=web_server, daemon=True)
     flask_thread.start()
     print("[Main] Flask server thread started.")
 
@@ -380,9 +874,15 @@ if __name__ == "__main__":
     root = tk.Tk()
     gui = AppGUI(root, capture_manager)
     print("[Main] Tkinter GUI started.")
-    root.mainloop()
-    
-    # 5. Cleanup on GUI exit
-    print("[Main] GUI closed, cleaning up...")
-    capture_manager.stop_capture()
-    print("[Main] Application finished.")
+    # ffmpeg runs in its own session, so signals sent to us don't reach it. Quit the GUI on
+    # SIGTERM/SIGHUP, and let Ctrl+C (KeyboardInterrupt) fall through to the same cleanup.
+    for sig in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, lambda signum, frame: root.quit())
+    try:
+        root.mainloop()
+    finally:
+        # 5. Cleanup on GUI exit, so ffmpeg never outlives us holding the camera
+        print("[Main] GUI closed, cleaning up...")
+        gui.detach()
+        capture_manager.stop_capture(wait=True)
+        print("[Main] Application finished.")
@@ -1,4 +1,5 @@
 sudo apt update
 sudo apt install -y libudev-dev libv4l-dev libasound2-dev
 sudo apt install python3-flask
+sudo apt install -y python3-waitress
 #sudo pip3 install Flask
@@ -1,6 +1,7 @@
 import subprocess
 import os
 import sys
+import signal
 from flask import Flask, request, render_template_string
 import threading
 import time
@@ -11,6 +12,10 @@ app = Flask(__name__)
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 CAMERA_RECORDER_EXECUTABLE = os.path.join(CURRENT_DIR, "camera_recorder")
 RECORDINGS_DIR = os.path.join(CURRENT_DIR, "recordings")
+RECORDER_STOP_TIMEOUT = 3 # Seconds to wait for the recorder to save its file and exit
+
+# The recorder launched by this server, so it can be signalled directly
+_recorder_proc = None
 
 # --- HTML Template with added buttons, confirmation dialogues, and a banner ---
 HTML_TEMPLATE = """
@@ -114,24 +119,38 @@ HTML_TEMPLATE = """
 # --- Helper function to stop the C++ recorder process ---
 def stop_recorder_process():
     """Sends SIGINT to the C++ process to trigger graceful shutdown."""
-    try:
-        # Use pkill to send a SIGINT signal to the C++ process
-        # The `-f` flag matches the full command line, which is useful
-        subprocess.run(['pkill', '-SIGINT', '-f', CAMERA_RECORDER_EXECUTABLE], check=True)
-        # Give the process a moment to save the file and exit
-        time.sleep(3)
-        return True
-    except subprocess.CalledProcessError:
+    global _recorder_proc
+    if _recorder_proc is None:
+        # Not started by this server (e.g. by run.sh), so find it by its command line
+        try:
+            subprocess.run(['pkill', '-SIGINT', '-f', CAMERA_RECORDER_EXECUTABLE], check=True)
+            # Give the process a moment to save the file and exit
+            time.sleep(RECORDER_STOP_TIMEOUT)
+            return True
+        except subprocess.CalledProcessError:
+            print("Recorder process was not running.")
+            return False
+
+    proc, _recorder_proc = _recorder_proc, None
+    if proc.poll() is not None:
         print("Recorder process was not running.")
         return False
+    proc.send_signal(signal.SIGINT)
+    try:
+        # Returns as soon as the recorder has saved its file and exited
+        proc.wait(timeout=RECORDER_STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        print("Recorder did not exit in time after SIGINT.")
+    return True
 
 # --- Helper function to launch the C++ recorder process ---
 def launch_recorder_process():
-    """Launches the C++ recorder process in the background using nohup."""
+    """Launches the C++ recorder process in the background."""
+    global _recorder_proc
     try:
-        # Popen is non-blocking. nohup ensures it keeps running after the shell exits.
-        # preexec_fn=os.setpgrp is needed to detach the process from the parent group.
-        subprocess.Popen(['nohup', CAMERA_RECORDER_EXECUTABLE, '&'], preexec_fn=os.setpgrp)
+        # Popen is non-blocking. preexec_fn=os.setpgrp detaches the process from the parent group.
+        _recorder_proc = subprocess.Popen([CAMERA_RECORDER_EXECUTABLE], preexec_fn=os.setpgrp,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         return True
     except FileNotFoundError:
         print(f"Error: Executable not found at {CAMERA_RECORDER_EXECUTABLE}")
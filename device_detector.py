@@ -39,8 +39,9 @@ def find_active_video_device():
 def find_active_audio_device():
     """Finds an active USB audio device by trying to record a short clip, returning the plughw ID."""
     try:
-        output = subprocess.check_output(["arecord", "-l"], stderr=subprocess.DEVNULL).decode("utf-8")
-        usb_devices = re.findall(r"card (\d+):.*USB", output, re.IGNORECASE)
+        # Match on the raw bytes, the output doesn't need decoding just to find the card numbers
+        output = subprocess.check_output(["arecord", "-l"], stderr=subprocess.DEVNULL)
+        usb_devices = [card.decode() for card in re.findall(rb"card (\d+):.*USB", output, re.IGNORECASE)]
         
         for card_num in usb_devices:
             # *** USE plughw INSTEAD OF hw ***
@@ -1,59 +1,216 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog
-from flask import Flask, render_template, jsonify, request, current_app
+from flask import Flask, render_template, jsonify, request, current_app, abort, send_from_directory
 import threading
 import subprocess
 import os
 import re
 import glob
+import select
+import selectors
+import socket
 import time
-import shutil
+import collections
 import sys
+import array
+import struct
+import ctypes
+import ctypes.util
+import fcntl
+import errno
 from datetime import datetime
 
 # --- Configuration ---
 RAM_DISK_PATH = "/dev/shm/hls_buffer"
 VIDEO_SAVE_DIR = os.path.expanduser("~/Videos/Recordings")
+SAVE_LIST_PATH = "/dev/shm/save_list.txt" # concat list for saves; kept out of RAM_DISK_PATH so clearing the buffer can't race it
 BUFFER_DURATION_SECONDS = 900
 HLS_SEGMENT_DURATION = 4
 HLS_LIST_SIZE = BUFFER_DURATION_SECONDS // HLS_SEGMENT_DURATION
 VALIDATION_DURATION_SECONDS = 3 # How long to test an encoder for
+ENCODER_VALIDATION_SECONDS = {'h264_v4l2m2m': 5} # v4l2m2m can take a few frames to warm up before its first keyframe
+FFMPEG_LOG_TAIL_LINES = 200 # stderr lines kept from the capture ffmpeg for the crash log
+UPTIME_TICK_INTERVAL = 1.0 # GUI refresh period while recording, for the uptime and free RAM figures
+STATS_CACHE_TTL = 0.1 # Seconds a get_stats snapshot is shared between the GUI and web clients
+SEGMENT_RING_SIZE = HLS_LIST_SIZE + 8 # ffmpeg keeps a few segments past the playlist before deleting them
+
+# Opened once for all probe subprocesses instead of subprocess.DEVNULL opening /dev/null on every call.
+# The probes run with close_fds=False: every fd this process creates is close-on-exec anyway (PEP 446),
+# so skipping the close_fds sweep doesn't leak anything into the children.
+_DEVNULL_FD = os.open(os.devnull, os.O_RDWR)
+
+# Compiled once and reused, rather than looked up in re's cache on every call
+_USB_CARD_RE = re.compile(r"card (\d+):.*USB", re.IGNORECASE)
+# ffmpeg messages that mean the encoder output is unusable. Matched on raw stderr bytes.
+_CRITICAL_FFMPEG_ERRORS = (b'non-existing PPS', b'decode_slice_header error', b'no frame!', b'Error initializing')
+_SEGMENT_NAME_RE = re.compile(r"segment(\d+)\.ts$")
+_HLS_FILE_RE = re.compile(r"(playlist\.m3u8|segment\d{6}\.ts)") # The only names /hls/ will serve
+# Set explicitly: Debian's /etc/mime.types maps .ts to Qt Linguist files
+HLS_MIMETYPES = {".m3u8": "application/vnd.apple.mpegurl", ".ts": "video/mp2t"}
+
+# inotify(7) event bits and the struct inotify_event header (wd, mask, cookie, len)
+IN_CLOSE_WRITE, IN_DELETE, IN_DELETE_SELF, IN_Q_OVERFLOW, IN_IGNORED = 0x8, 0x200, 0x400, 0x4000, 0x8000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+# ffmpeg argv templates, built once. The None slots are filled in per run by _ffmpeg_command, in order:
+# resolution, video device, audio device, (validation time,) encoder, encoder options.
+_HLS_TIME_S = str(HLS_SEGMENT_DURATION)
+_HLS_LIST_S = str(HLS_LIST_SIZE)
+_DEFAULT_VALIDATION_DURATION_S = str(VALIDATION_DURATION_SECONDS)
+_VALIDATION_DURATION_S = {encoder: str(seconds) for encoder, seconds in ENCODER_VALIDATION_SECONDS.items()}
+_HLS_PLAYLIST_PATH = os.path.join(RAM_DISK_PATH, 'playlist.m3u8')
+_HLS_SEGMENT_PATTERN = os.path.join(RAM_DISK_PATH, 'segment%06d.ts')
+_INPUT_ARGS = ('ffmpeg', '-nostdin',
+               '-f', 'v4l2', '-input_format', 'yuyv422', '-video_size', None, '-framerate', '30', '-i', None,
+               '-f', 'alsa', '-ac', '1', '-ar', '44100', '-i', None)
+_VALIDATE_TEMPLATE = _INPUT_ARGS + (
+    '-t', None, # Run for a short time
+    '-c:v', None, None,
+    '-c:a', 'aac',
+    '-f', 'null', '-') # Output to null
+_CAPTURE_TEMPLATE = _INPUT_ARGS + (
+    '-c:v', None, None, '-b:v', '1M', '-g', '60',
+    '-c:a', 'aac', '-b:a', '128k',
+    '-f', 'hls', '-hls_time', _HLS_TIME_S, '-hls_list_size', _HLS_LIST_S,
+    '-hls_flags', 'delete_segments',
+    '-hls_segment_filename', _HLS_SEGMENT_PATTERN,
+    _HLS_PLAYLIST_PATH)
+_VALIDATE_SLOTS = tuple(i for i, arg in enumerate(_VALIDATE_TEMPLATE) if arg is None)
+_CAPTURE_SLOTS = tuple(i for i, arg in enumerate(_CAPTURE_TEMPLATE) if arg is None)
+
+# Per-encoder options. The Pi's hardware encoder wants planar 4:2:0 input and deeper buffer queues,
+# and has no -preset; the software encoder gets its fastest, lowest-CPU preset.
+_ENCODER_ARGS = {
+    'h264_v4l2m2m': ('-pix_fmt', 'yuv420p', '-num_output_buffers', '32', '-num_capture_buffers', '16'),
+    'libx264': ('-preset', 'ultrafast'),
+}
+_DEFAULT_ENCODER_ARGS = ('-preset', 'fast')
+
+def _ffmpeg_command(template, slots, *values):
+    command = list(template)
+    for i, value in reversed(tuple(zip(slots, values))): # Back to front, so spliced tuples don't shift later slots
+        command[i:i + 1] = value if isinstance(value, tuple) else (value,)
+    return command
+
+# V4L2 ioctls and structs from linux/videodev2.h, for checking cameras without running ffmpeg
+_V4L2_CAPABILITY = struct.Struct('16s32s32sIII12x') # driver, card, bus_info, version, capabilities, device_caps
+_V4L2_FRMSIZEENUM = struct.Struct('III6I8x') # index, pixel_format, type, discrete/stepwise sizes
+_VIDIOC_QUERYCAP = (2 << 30) | (_V4L2_CAPABILITY.size << 16) | (ord('V') << 8) | 0 # _IOR('V', 0, ...)
+_VIDIOC_ENUM_FRAMESIZES = (3 << 30) | (_V4L2_FRMSIZEENUM.size << 16) | (ord('V') << 8) | 74 # _IOWR('V', 74, ...)
+_V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+_V4L2_CAP_DEVICE_CAPS = 0x80000000
+_V4L2_FRMSIZE_TYPE_DISCRETE = 1
+_V4L2_PIX_FMT_YUYV = int.from_bytes(b'YUYV', 'little')
 
 class DeviceDetector:
-    # ... (No changes needed here, keeping it the same as your provided version) ...
+    """Finds active audio/video devices by probing all candidates in parallel."""
     def eprint(self, *args, **kwargs):
         print(f"[Detector] ", *args, file=sys.stderr, **kwargs)
 
+    def _first_successful(self, candidates):
+        """Runs all (device, command) probes at once and returns the first device whose probe exits cleanly."""
+        processes = {}
+        for device, command in candidates:
+            try:
+                processes[device] = subprocess.Popen(command, stdout=_DEVNULL_FD, stderr=subprocess.PIPE, close_fds=False)
+            except FileNotFoundError:
+                self.eprint(f"Cannot test {device}: '{command[0]}' not found.")
+        winner = None
+        try:
+            while processes and winner is None:
+                streams = {p.stderr: device for device, p in processes.items()}
+                readable, _, _ = select.select(list(streams), [], [], 2.0)
+                for stream in readable:
+                    if os.read(stream.fileno(), 4096):
+                        continue # Just drain it so the probe can't block on a full pipe
+                    # EOF, the probe is exiting
+                    device = streams[stream]
+                    process = processes.pop(device)
+                    process.wait()
+                    process.stderr.close()
+                    if process.returncode == 0:
+                        winner = device
+                        break # Leaves the remaining probes to the cleanup below
+                    self.eprint(f"{device} failed test.")
+        finally:
+            # Stop the losing probes so they don't keep the device busy
+            for process in processes.values():
+                process.terminate()
+                process.wait()
+                process.stderr.close()
+        return winner
+
+    def _query_v4l2(self, device, resolution):
+        """Asks the driver if the device can capture YUYV at the resolution, without capturing anything.
+
+        Returns True or False, or None if the device couldn't be queried and ffmpeg has to decide.
+        """
+        try:
+            width, height = (int(v) for v in resolution.split('x'))
+            fd = os.open(device, os.O_RDWR | os.O_NONBLOCK)
+        except (ValueError, OSError):
+            return None
+        try:
+            caps = bytearray(_V4L2_CAPABILITY.size)
+            fcntl.ioctl(fd, _VIDIOC_QUERYCAP, caps)
+            _, _, _, _, capabilities, device_caps = _V4L2_CAPABILITY.unpack(caps)
+            if capabilities & _V4L2_CAP_DEVICE_CAPS:
+                capabilities = device_caps # Capabilities of this node rather than the whole device
+            if not capabilities & _V4L2_CAP_VIDEO_CAPTURE:
+                return False
+            
+            index = 0
+            while True:
+                frmsize = bytearray(_V4L2_FRMSIZEENUM.pack(index, _V4L2_PIX_FMT_YUYV, 0, 0, 0, 0, 0, 0, 0))
+                try:
+                    fcntl.ioctl(fd, _VIDIOC_ENUM_FRAMESIZES, frmsize)
+                except OSError as e:
+                    if e.errno == errno.EINVAL:
+                        return False # End of the list, or YUYV isn't supported at all
+                    raise
+                _, _, size_type, *sizes = _V4L2_FRMSIZEENUM.unpack(frmsize)
+                if size_type == _V4L2_FRMSIZE_TYPE_DISCRETE:
+                    if sizes[0] == width and sizes[1] == height:
+                        return True
+                    index += 1
+                    continue
+                # Stepwise and continuous ranges are reported as a single entry
+                min_w, max_w, step_w, min_h, max_h, step_h = sizes
+                return (min_w <= width <= max_w and (width - min_w) % max(step_w, 1) == 0 and
+                        min_h <= height <= max_h and (height - min_h) % max(step_h, 1) == 0)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
     def find_active_video_device(self, resolution):
         potential_devices = sorted(glob.glob('/dev/video*'))
+        self.eprint(f"Testing video devices {potential_devices} at {resolution}...")
+        unknown_devices = []
         for device in potential_devices:
-            self.eprint(f"Testing video device: {device} at {resolution}...")
-            command = ["ffmpeg","-f","v4l2","-video_size",resolution,"-i",device,"-t","0.5","-frames:v","1","-f","null","-","-loglevel","error"]
-            try:
-                subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            supported = self._query_v4l2(device, resolution)
+            if supported:
                 self.eprint(f"Success! Active video device found: {device}")
                 return device
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                self.eprint(f"{device} failed test or is not a capture device.")
-                continue
+            if supported is None:
+                unknown_devices.append(device)
+        # Only devices the driver couldn't answer for are tested with ffmpeg
+        device = self._first_successful([(device, ["ffmpeg","-f","v4l2","-video_size",resolution,"-i",device,"-t","0.5","-frames:v","1","-f","null","-","-loglevel","error"]) for device in unknown_devices])
+        if device:
+            self.eprint(f"Success! Active video device found: {device}")
+            return device
         self.eprint("Warning: No active video device found.")
         return None
 
     def find_active_audio_device(self):
         try:
-            output = subprocess.check_output(["arecord", "-l"], stderr=subprocess.DEVNULL).decode("utf-8")
-            usb_devices = re.findall(r"card (\d+):.*USB", output, re.IGNORECASE)
-            for card_num in usb_devices:
-                device_id = f"plughw:{card_num},0"
-                self.eprint(f"Testing audio device: {device_id}...")
-                command = ["arecord","-D",device_id,"-f","S16_LE","-r","44100","-d","1","/dev/null"]
-                try:
-                    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                    self.eprint(f"Success! Active audio device found: {device_id}")
-                    return device_id
-                except (subprocess.CalledProcessError, FileNotFoundError):
-                    self.eprint(f"{device_id} is not an active audio input.")
-                    continue
+            output = subprocess.check_output(["arecord", "-l"], stderr=_DEVNULL_FD, close_fds=False).decode("utf-8")
+            device_ids = [f"plughw:{card_num},0" for card_num in _USB_CARD_RE.findall(output)]
+            self.eprint(f"Testing audio devices {device_ids}...")
+            device_id = self._first_successful([(device_id, ["arecord","-D",device_id,"-f","S16_LE","-r","44100","-d","1","/dev/null"]) for device_id in device_ids])
+            if device_id:
+                self.eprint(f"Success! Active audio device found: {device_id}")
+                return device_id
         except (subprocess.CalledProcessError, FileNotFoundError):
             self.eprint("Error: 'arecord' command not found or failed.")
         self.eprint("Warning: No active USB audio device found.")
@@ -66,6 +223,12 @@ class CaptureManager:
         self.detector = DeviceDetector()
         self.lock = threading.Lock()
         self.ffmpeg_process = None
+        # The GUI watches stats_socket and redraws only when _notify_stats says something changed
+        self.stats_socket, self._stats_w = socket.socketpair()
+        self.stats_socket.setblocking(False); self._stats_w.setblocking(False)
+        self._stats_gen = 0
+        self._recording = threading.Event() # Set while capture runs, gates _uptime_tick_loop
+        threading.Thread(target=self._uptime_tick_loop, daemon=True).start()
         self.status = "Stopped"
         self.capture_thread = None
         self.is_running = False
@@ -74,49 +237,185 @@ class CaptureManager:
         self.last_video_device = None
         self.last_audio_device = None
         self.active_encoder = "N/A"
+        self._stats_cache = None; self._stats_cache_ts = 0.0; self._stats_cache_gen = -1
+        self._stats_cache_lock = threading.Lock() # Separate from self.lock so stats callers don't hold up capture control
+        self._segment_sizes = {} # Sizes of finished segments; they never change, so each is only stat'ed once
+        
+        # Segment accounting kept up to date by inotify, so get_stats doesn't have to touch the directory.
+        # Slot seq % SEGMENT_RING_SIZE holds the sequence number and size of each buffered segment.
+        self._seg_lock = threading.Lock()
+        self._seg_seqs = array.array('q', [-1] * SEGMENT_RING_SIZE)
+        self._seg_sizes = array.array('q', [0] * SEGMENT_RING_SIZE)
+        self._seg_total = 0
+        self._seg_count = 0
+        self._seg_watch_active = False
+        self._seg_wd = None
+        self._inotify_fd = None
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._libc.inotify_init1 # Raises AttributeError if this libc has no inotify
+        except (OSError, AttributeError):
+            self._libc = None
         
         os.makedirs(RAM_DISK_PATH, exist_ok=True)
         os.makedirs(VIDEO_SAVE_DIR, exist_ok=True)
+        self._hls_dir_fd = os.open(RAM_DISK_PATH, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC) # Kept open so clearing needs no path lookups
+
+    def _clear_hls(self):
+        """Empties the HLS buffer in place. It only ever holds flat .ts/.m3u8 files, so no recursive walk is needed."""
+        if os.fstat(self._hls_dir_fd).st_nlink == 0: # The directory was removed under us, the fd points at a dead inode
+            print(f"[Manager] WARN: {RAM_DISK_PATH} was removed, recreating it.")
+            os.makedirs(RAM_DISK_PATH, exist_ok=True)
+            os.close(self._hls_dir_fd)
+            self._hls_dir_fd = os.open(RAM_DISK_PATH, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        with os.scandir(self._hls_dir_fd) as it:
+            for e in it:
+                try: os.unlink(e.name, dir_fd=self._hls_dir_fd)
+                except FileNotFoundError: pass # ffmpeg may still be rotating segments out
+
+    def _start_segment_watch(self):
+        """(Re)arms the inotify watch on RAM_DISK_PATH and seeds the ring from its current contents."""
+        if self._libc is None:
+            return
+        if self._inotify_fd is None:
+            fd = self._libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                print(f"[Manager] WARN: inotify unavailable ({os.strerror(ctypes.get_errno())}), scanning the buffer instead.")
+                self._libc = None
+                return
+            self._inotify_fd = fd
+            threading.Thread(target=self._segment_watch_loop, daemon=True).start()
+        wd = self._libc.inotify_add_watch(self._inotify_fd, os.fsencode(RAM_DISK_PATH), IN_CLOSE_WRITE | IN_DELETE | IN_DELETE_SELF)
+        if wd < 0:
+            print(f"[Manager] WARN: Could not watch {RAM_DISK_PATH} ({os.strerror(ctypes.get_errno())}), scanning the buffer instead.")
+            return
+        with self._seg_lock:
+            self._seg_wd = wd
+            self._reset_segment_ring()
+            self._seg_watch_active = True
+        self._notify_stats()
+
+    def _reset_segment_ring(self):
+        # Caller holds _seg_lock
+        for i in range(SEGMENT_RING_SIZE):
+            self._seg_seqs[i] = -1
+            self._seg_sizes[i] = 0
+        self._seg_total = 0
+        self._seg_count = 0
+        try:
+            with os.scandir(RAM_DISK_PATH) as it:
+                for e in it:
+                    match = _SEGMENT_NAME_RE.match(e.name)
+                    if not match:
+                        continue
+                    try:
+                        self._add_segment(int(match.group(1)), e.stat(follow_symlinks=False).st_size)
+                    except FileNotFoundError:
+                        pass # Rotated out by ffmpeg while scanning
+        except FileNotFoundError:
+            pass
+
+    def _add_segment(self, seq, size):
+        # Caller holds _seg_lock
+        idx = seq % SEGMENT_RING_SIZE
+        if self._seg_seqs[idx] == -1:
+            self._seg_count += 1
+        self._seg_total += size - self._seg_sizes[idx] # Replaces whatever the slot held before
+        self._seg_seqs[idx] = seq
+        self._seg_sizes[idx] = size
+
+    def _remove_segment(self, seq):
+        # Caller holds _seg_lock
+        idx = seq % SEGMENT_RING_SIZE
+        if self._seg_seqs[idx] != seq:
+            return # Already replaced or never seen
+        self._seg_total -= self._seg_sizes[idx]
+        self._seg_count -= 1
+        self._seg_seqs[idx] = -1
+        self._seg_sizes[idx] = 0
+
+    def _segment_watch_loop(self):
+        while True:
+            try:
+                data = os.read(self._inotify_fd, 64 * 1024)
+            except OSError as e:
+                print(f"[Manager] ERROR: inotify read failed: {e}")
+                with self._seg_lock:
+                    self._seg_watch_active = False
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + name_len].rstrip(b'\0').decode(errors='ignore')
+                offset += name_len
+                with self._seg_lock:
+                    if mask & IN_Q_OVERFLOW:
+                        self._reset_segment_ring() # Events were lost, rescan
+                        continue
+                    if wd != self._seg_wd:
+                        continue # Left over from a buffer directory that was replaced
+                    if mask & (IN_DELETE_SELF | IN_IGNORED):
+                        self._seg_watch_active = False
+                        continue
+                    match = _SEGMENT_NAME_RE.match(name)
+                    if not match:
+                        continue
+                    seq = int(match.group(1))
+                    if mask & IN_CLOSE_WRITE:
+                        # ffmpeg has finished the segment, so its size is final
+                        try:
+                            self._add_segment(seq, os.stat(os.path.join(RAM_DISK_PATH, name)).st_size)
+                        except FileNotFoundError:
+                            pass
+                    elif mask & IN_DELETE:
+                        self._remove_segment(seq)
+            self._notify_stats() # One redraw per batch of events
 
     def _validate_ffmpeg_config(self, encoder, resolution, video_device, audio_device):
         """Runs ffmpeg for a short time to check for critical errors."""
-        print(f"[Validator] Testing encoder '{encoder}' for {VALIDATION_DURATION_SECONDS} seconds...")
+        duration = ENCODER_VALIDATION_SECONDS.get(encoder, VALIDATION_DURATION_SECONDS)
+        print(f"[Validator] Testing encoder '{encoder}' for {duration} seconds...")
         with self.lock:
             self.status = f"Validating {encoder}..."
             
-        # For software encoder, use a very fast, low-CPU preset for the test
-        preset = 'ultrafast' if encoder == 'libx264' else 'fast'
-        
-        command = [
-            'ffmpeg', '-nostdin',
-            '-f', 'v4l2', '-input_format', 'yuyv422', '-video_size', resolution, '-framerate', '30', '-i', video_device,
-            '-f', 'alsa', '-ac', '1', '-ar', '44100', '-i', audio_device,
-            '-t', str(VALIDATION_DURATION_SECONDS), # Run for a short time
-            '-c:v', encoder, '-preset', preset,
-            '-c:a', 'aac',
-            '-f', 'null', '-' # Output to null
-        ]
+        command = _ffmpeg_command(_VALIDATE_TEMPLATE, _VALIDATE_SLOTS, resolution, video_device, audio_device,
+                                  _VALIDATION_DURATION_S.get(encoder, _DEFAULT_VALIDATION_DURATION_S),
+                                  encoder, _ENCODER_ARGS.get(encoder, _DEFAULT_ENCODER_ARGS))
         
-        has_critical_error = threading.Event()
+        has_critical_error = False
         
-        process = subprocess.Popen(command, stderr=subprocess.PIPE, text=True, errors='ignore')
-
-        # Monitor stderr in a separate thread for killer error messages
-        def monitor_stderr():
-            for line in iter(process.stderr.readline, ''):
-                # Check for the errors we saw before, or other common ones
-                if 'non-existing PPS' in line or 'decode_slice_header error' in line or 'no frame!' in line or 'Error initializing' in line:
-                    print(f"[Validator] CRITICAL FFMPEG ERROR DETECTED with {encoder}: {line.strip()}")
-                    has_critical_error.set()
-                    break
-        
-        stderr_thread = threading.Thread(target=monitor_stderr)
-        stderr_thread.start()
-        
-        process.wait() # Wait for the short process to finish
-        stderr_thread.join() # Ensure the monitoring thread is done
+        process = subprocess.Popen(command, stdout=_DEVNULL_FD, stderr=subprocess.PIPE, close_fds=False)
 
-        if has_critical_error.is_set() or process.returncode != 0:
+        # Scan stderr for killer error messages from this thread, as it becomes readable
+        stderr_fd = process.stderr.fileno()
+        os.set_blocking(stderr_fd, False)
+        pending = b''
+        with selectors.DefaultSelector() as sel:
+            sel.register(stderr_fd, selectors.EVENT_READ)
+            while True:
+                if not sel.select(timeout=0.2):
+                    continue
+                try:
+                    data = os.read(stderr_fd, 4096)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    break # EOF, ffmpeg has exited
+                if has_critical_error:
+                    continue # Just drain until ffmpeg is gone
+                *lines, pending = (pending + data).replace(b'\r', b'\n').split(b'\n')
+                for line in lines:
+                    # Check for the errors we saw before, or other common ones
+                    if any(marker in line for marker in _CRITICAL_FFMPEG_ERRORS):
+                        print(f"[Validator] CRITICAL FFMPEG ERROR DETECTED with {encoder}: {line.decode(errors='ignore').strip()}")
+                        has_critical_error = True
+                        process.terminate() # No need to run the test to the end
+                        break
+        process.stderr.close()
+        process.wait() # Reap the short process
+
+        if has_critical_error or process.returncode != 0:
             print(f"[Validator] FAILED validation for encoder '{encoder}'. Return code: {process.returncode}.")
             return False
         
@@ -141,7 +440,7 @@ class CaptureManager:
             
             # --- Encoder Validation Stage ---
             #encoder_fallback_order = ['h264_v4l2m2m', 'h264_omx', 'libx264']
-            encoder_fallback_order = ['libx264']
+            encoder_fallback_order = ['h264_v4l2m2m', 'libx264'] # Hardware first, software only if it fails validation
             working_encoder = None
             
             for encoder in encoder_fallback_order:
@@ -164,33 +463,57 @@ class CaptureManager:
                 self.status = f"Starting capture with {working_encoder}..."
                 self.active_encoder = working_encoder
             
-            if os.path.exists(RAM_DISK_PATH): shutil.rmtree(RAM_DISK_PATH)
-            os.makedirs(RAM_DISK_PATH, exist_ok=True)
-            
-            preset = 'ultrafast' if working_encoder == 'libx264' else 'fast'
+            self._clear_hls()
+            with self.lock: self._segment_sizes = {} # ffmpeg starts numbering from zero again
+            self._start_segment_watch()
             
-            command = [
-                'ffmpeg', '-nostdin',
-                '-f', 'v4l2', '-input_format', 'yuyv422', '-video_size', current_resolution, '-framerate', '30', '-i', video_device,
-                '-f', 'alsa', '-ac', '1', '-ar', '44100', '-i', audio_device,
-                '-c:v', working_encoder, '-preset', preset, '-b:v', '1M', '-g', '60',
-                '-c:a', 'aac', '-b:a', '128k',
-                '-f', 'hls', '-hls_time', str(HLS_SEGMENT_DURATION), '-hls_list_size', str(HLS_LIST_SIZE),
-                '-hls_flags', 'delete_segments',
-                '-hls_segment_filename', os.path.join(RAM_DISK_PATH, 'segment%06d.ts'),
-                os.path.join(RAM_DISK_PATH, 'playlist.m3u8')
-            ]
+            command = _ffmpeg_command(_CAPTURE_TEMPLATE, _CAPTURE_SLOTS, current_resolution, video_device, audio_device,
+                                      working_encoder, _ENCODER_ARGS.get(working_encoder, _DEFAULT_ENCODER_ARGS))
             
             print(f"[Manager] Starting main capture with command: {' '.join(command)}")
-            self.ffmpeg_process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
             with self.lock:
-                self.status = f"Recording with {working_encoder}"
+                if not self.is_running:
+                    break # stop_capture ran while we were preparing, and had no process to terminate
+                # Started under the lock, so stop_capture either sees this process or we see the stop
+                process = self.ffmpeg_process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
                 self.start_time = time.time()
+                self.status = f"Recording with {working_encoder}"
             
-            _, stderr = self.ffmpeg_process.communicate()
+            # Drain stderr as it arrives, keeping only the tail for the crash log
+            stderr_tail = collections.deque(maxlen=FFMPEG_LOG_TAIL_LINES)
+            stderr_fd = process.stderr.fileno()
+            os.set_blocking(stderr_fd, False)
+            pending = b''
+            terminated_at = None
+            with selectors.DefaultSelector() as sel:
+                sel.register(stderr_fd, selectors.EVENT_READ)
+                while True:
+                    # Make sure a requested stop actually ends ffmpeg. Checked on every pass, since
+                    # ffmpeg's progress output can keep the select from ever timing out.
+                    if not self.is_running and process.poll() is None:
+                        if terminated_at is None:
+                            process.terminate()
+                            terminated_at = time.monotonic()
+                        elif time.monotonic() - terminated_at > 3:
+                            print("[Manager] ffmpeg did not exit in time, killing it.")
+                            process.kill()
+                    if not sel.select(timeout=1.0):
+                        continue
+                    try:
+                        data = os.read(stderr_fd, 4096)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        break # EOF, ffmpeg has exited
+                    *lines, pending = (pending + data).replace(b'\r', b'\n').split(b'\n')
+                    stderr_tail.extend(line for line in lines if line)
+            if pending:
+                stderr_tail.append(pending)
+            process.stderr.close()
+            process.wait()
             if self.is_running:
-                print(f"[Manager] ERROR: ffmpeg capture process exited unexpectedly. Code: {self.ffmpeg_process.returncode}")
-                print(f"[Manager] FFMPEG STDERR:\n{stderr.decode(errors='ignore')}")
+                print(f"[Manager] ERROR: ffmpeg capture process exited unexpectedly. Code: {process.returncode}")
+                print("[Manager] FFMPEG STDERR (last lines):\n" + b'\n'.join(stderr_tail).decode(errors='ignore'))
                 with self.lock:
                     self.status = "ffmpeg crashed. Restarting..."
                 time.sleep(5)
@@ -199,37 +522,65 @@ class CaptureManager:
             self.status = "Stopped"
         print("[Manager] Capture loop has terminated.")
 
+    def _buffered_segments(self):
+        """Paths of the finished segments in the buffer, oldest first, or [] if the inotify ring isn't tracking them."""
+        with self._seg_lock:
+            if not self._seg_watch_active: return []
+            seqs = sorted(seq for seq in self._seg_seqs if seq >= 0)
+        return [os.path.join(RAM_DISK_PATH, f"segment{seq:06d}.ts") for seq in seqs]
+
+    @staticmethod
+    def _release_page_cache(path):
+        """Flushes a saved recording and drops it from the page cache; it isn't read again, and on a Pi
+        those pages would otherwise compete with the RAM buffer."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try: os.fdatasync(fd); os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED) # DONTNEED skips dirty pages, hence the sync
+            finally: os.close(fd)
+        except OSError as e: print(f"[Manager] WARN: Could not release page cache for {path}: {e}")
+
     def save_to_disk(self):
         with self.lock:
             if not self.is_running or not self.status.startswith("Recording"):
                 return {"status": "error", "message": "Capture is not running."}
             self.status = "Saving video..."
         
-        playlist_path = os.path.join(RAM_DISK_PATH, 'playlist.m3u8')
-        
-        # --- Pre-save Validation using ffprobe ---
-        print("[Manager] Validating HLS buffer before saving...")
-        try:
-            # Check if ffprobe can read the stream info from the HLS playlist
-            ffprobe_cmd = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', playlist_path]
-            subprocess.run(ffprobe_cmd, check=True, capture_output=True)
-            print("[Manager] HLS buffer validation successful.")
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            print("[Manager] ERROR: HLS buffer in RAM is invalid or unreadable. Cannot save.")
-            with self.lock: self.status = f"Recording with {self.active_encoder}"
-            return {"status": "error", "message": "Buffer is invalid. Save aborted."}
-
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         output_filename = os.path.join(VIDEO_SAVE_DIR, f"recording_{timestamp}.mp4")
         
-        save_command = [
-            'ffmpeg', '-y', '-i', playlist_path, '-c', 'copy', '-absf', 'aac_adtstoasc', output_filename
-        ]
+        segments = self._buffered_segments()
+        if segments:
+            # The inotify ring already knows every finished segment, so hand ffmpeg the list directly
+            # through the concat demuxer instead of making it parse (and us validate) the playlist.
+            with open(SAVE_LIST_PATH, 'w') as f: f.writelines(f"file '{path}'\n" for path in segments)
+            save_command = [
+                'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', SAVE_LIST_PATH, '-c', 'copy', '-bsf:a', 'aac_adtstoasc', output_filename
+            ]
+        else:
+            playlist_path = _HLS_PLAYLIST_PATH
+            
+            # --- Pre-save Validation using ffprobe ---
+            print("[Manager] Validating HLS buffer before saving...")
+            try:
+                # Check if ffprobe can read the HLS playlist. Only the exit code matters, so ask for a
+                # single field and send the output straight to /dev/null instead of through pipes.
+                ffprobe_cmd = ['ffprobe', '-v', 'error', '-of', 'default=nw=1', '-show_entries', 'format=duration', playlist_path]
+                subprocess.run(ffprobe_cmd, check=True, stdout=_DEVNULL_FD, stderr=_DEVNULL_FD, close_fds=False)
+                print("[Manager] HLS buffer validation successful.")
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                print("[Manager] ERROR: HLS buffer in RAM is invalid or unreadable. Cannot save.")
+                with self.lock: self.status = f"Recording with {self.active_encoder}"
+                return {"status": "error", "message": "Buffer is invalid. Save aborted."}
+            
+            save_command = [
+                'ffmpeg', '-y', '-i', playlist_path, '-c', 'copy', '-bsf:a', 'aac_adtstoasc', output_filename
+            ]
         
         print(f"[Manager] Saving video with command: {' '.join(save_command)}")
         try:
             subprocess.run(save_command, check=True, capture_output=True, text=True)
             print(f"[Manager] Save successful: {output_filename}")
+            self._release_page_cache(output_filename)
             result = {"status": "success", "message": f"Saved to {output_filename}"}
         except subprocess.CalledProcessError as e:
             print(f"[Manager] ERROR: Save failed. Code: {e.returncode}\nSTDERR:\n{e.stderr}")
@@ -244,6 +595,7 @@ class CaptureManager:
         with self.lock:
             if self.is_running: print("[Manager] Capture is already running."); return
             self.is_running = True
+            self._recording.set()
             self.status = "Starting..."
             self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
             self.capture_thread.start()
@@ -253,6 +605,7 @@ class CaptureManager:
         with self.lock:
             if not self.is_running: print("[Manager] Capture is not running."); return
             self.is_running = False
+            self._recording.clear()
             if self.ffmpeg_process:
                 print("[Manager] Terminating ffmpeg process...")
                 try: self.ffmpeg_process.terminate()
@@ -271,17 +624,65 @@ class CaptureManager:
         with self.lock: self.resolution = new_resolution
         self.restart_capture()
 
+    @property
+    def status(self): return self._status
+    @status.setter
+    def status(self, value):
+        self._status = value; self._notify_stats()
+
+    def _notify_stats(self):
+        """Tells the GUI the stats changed. Called wherever state changes instead of polling get_stats."""
+        self._stats_gen += 1 # Invalidates the cached snapshot, so the redraw sees the change
+        try: self._stats_w.send(b'\x01' * 8)
+        except BlockingIOError: pass # The GUI already has unread ticks, one redraw covers them all
+
+    def _uptime_tick_loop(self):
+        # Uptime and free RAM change continuously, so tick once a second while recording.
+        # Blocks on _recording while stopped, so an idle manager doesn't wake up at all.
+        while True:
+            self._recording.wait()
+            time.sleep(UPTIME_TICK_INTERVAL)
+            if self.is_running:
+                self._notify_stats()
+
+    def _scan_segments(self):
+        """Fallback for when inotify isn't available: returns (segment count, total bytes) from the directory."""
+        try:
+            with os.scandir(RAM_DISK_PATH) as it: ts_entries = sorted((e for e in it if e.name.endswith('.ts')), key=lambda e: e.name)
+        except FileNotFoundError: ts_entries = []
+        sizes = {}; total_size = 0; newest = ts_entries[-1].name if ts_entries else None
+        for e in ts_entries:
+            size = self._segment_sizes.get(e.name)
+            if size is None:
+                try: size = e.stat(follow_symlinks=False).st_size
+                except FileNotFoundError: continue # Rotated out by ffmpeg
+                if e.name != newest: sizes[e.name] = size # The newest segment is still being written
+            else: sizes[e.name] = size
+            total_size += size
+        self._segment_sizes = sizes
+        return len(ts_entries), total_size
+
     def get_stats(self):
+        """Returns a stats snapshot. Callers within STATS_CACHE_TTL of each other share the same one."""
+        with self._stats_cache_lock:
+            now = time.monotonic(); gen = self._stats_gen # Read before collecting, so a change made meanwhile isn't cached over
+            if self._stats_cache is None or gen != self._stats_cache_gen or now - self._stats_cache_ts >= STATS_CACHE_TTL:
+                self._stats_cache = self._collect_stats(); self._stats_cache_ts = now; self._stats_cache_gen = gen
+            return self._stats_cache
+
+    def _collect_stats(self):
         with self.lock:
             stats = {"status": self.status, "resolution": self.resolution, "encoder": self.active_encoder, "uptime": 0, "buffer_size_mb": 0, "free_ram_mb": 0, "buffered_segments": 0, "max_segments": HLS_LIST_SIZE}
             if self.is_running and self.start_time: stats["uptime"] = time.time() - self.start_time
-            if os.path.exists(RAM_DISK_PATH):
-                total_size = 0; ts_files = glob.glob(os.path.join(RAM_DISK_PATH, '*.ts')); stats["buffered_segments"] = len(ts_files)
-                for f in ts_files: total_size += os.path.getsize(f)
-                stats["buffer_size_mb"] = total_size / (1024 * 1024)
-            try: mem_info = os.popen('free -m').read(); stats["free_ram_mb"] = int(re.search(r'Mem:\s+\d+\s+\d+\s+(\d+)', mem_info).group(1))
-            except: pass
-            return stats
+            with self._seg_lock: watched, segment_count, total_size = self._seg_watch_active, self._seg_count, self._seg_total
+            if not watched: segment_count, total_size = self._scan_segments()
+            stats["buffered_segments"] = segment_count; stats["buffer_size_mb"] = total_size / (1024 * 1024)
+        try: # Read the kernel's figure directly instead of forking a shell for 'free -m'
+            with open('/proc/meminfo', 'rb') as f: buf = f.read(2048)
+            i = buf.find(b'MemAvailable:'); j = buf.find(b'kB', i)
+            stats["free_ram_mb"] = int(buf[i + len(b'MemAvailable:'):j]) // 1024
+        except (OSError, ValueError): pass
+        return stats
 
 
 # --- Flask Web Server & Tkinter GUI (No changes needed, keeping them the same) ---
@@ -291,6 +692,11 @@ app = Flask(__name__)
 def index(): return render_template("index.html")
 @app.route("/api/status")
 def api_status(): return jsonify(current_app.config['manager'].get_stats())
+@app.route("/hls/<path:name>")
+def hls(name):
+    # Served straight from the RAM buffer; Werkzeug hands the open file to the server's sendfile path
+    if not _HLS_FILE_RE.fullmatch(name): abort(404)
+    return send_from_directory(RAM_DISK_PATH, name, mimetype=HLS_MIMETYPES[os.path.splitext(name)[1]], conditional=True, max_age=0)
 @app.route("/api/save")
 def api_save(): return jsonify(current_app.config['manager'].save_to_disk())
 @app.route("/api/restart")
@@ -321,6 +727,12 @@ class AppGUI(tk.Frame):
         #self.pause_button = tk.Button(control_frame, text="Pause Recording", command=self.toggle_pause); self.pause_button.pack(fill=tk.X, pady=5)
         self.save_button = tk.Button(control_frame, text="Save Buffer to Disk", command=self.save_video); self.save_button.pack(fill=tk.X, pady=5)
         self.stop_button = tk.Button(control_frame, text="Stop Program", command=self.stop_program, bg="salmon"); self.stop_button.pack(fill=tk.X, pady=5)
+        self.root.tk.createfilehandler(self.manager.stats_socket.fileno(), tk.READABLE, self._on_stats_tick)
+        self.update_stats()
+    def _on_stats_tick(self, *args):
+        try:
+            while self.manager.stats_socket.recv(4096): pass # Drain every pending tick, then redraw once
+        except BlockingIOError: pass
         self.update_stats()
     def update_stats(self):
         stats = self.manager.get_stats()
@@ -328,7 +740,6 @@ class AppGUI(tk.Frame):
         self.uptime_label.config(text=f"Uptime: {int(stats['uptime'])}s")
         self.buffer_label.config(text=f"Buffer: {stats['buffered_segments']}/{stats['max_segments']} segments ({stats['buffer_size_mb']:.2f} MB)")
         self.ram_label.config(text=f"Free RAM: {stats['free_ram_mb']} MB")
-        self.root.after(1000, self.update_stats)
     def toggle_pause(self):
         with self.manager.lock:
             if self.manager.status.startswith("Recording"):
@@ -1,10 +1,85 @@
 # stream_server.py
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import os
+import stat
 import time
+import queue
+import threading
 
 PORT = 8090
 PIPE_FILE = '/tmp/stream.ts'
+CHUNK_SIZE = 1 << 20 # Bytes moved per sendfile/read call, so many TS packets move per syscall
+TS_PACKET_SIZE = 188
+CLIENT_QUEUE_CHUNKS = 64 # Chunks a slow viewer may fall behind before it is dropped
+
+
+class FifoBroadcaster:
+    """Reads the FIFO from a single thread and hands every chunk to all connected clients.
+
+    Bytes read from a pipe are gone for every other reader, so clients reading the FIFO
+    themselves would each get a different slice of the stream. Chunks are cut on TS packet
+    boundaries so a viewer joining mid-stream starts on a whole packet.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.thread = None
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=CLIENT_QUEUE_CHUNKS)
+        with self.lock:
+            self.clients.add(client)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._read_loop, daemon=True)
+                self.thread.start()
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def _read_loop(self):
+        while True:
+            src_fd = os.open(self.path, os.O_RDONLY)
+            pending = b''
+            try:
+                while True:
+                    data = os.read(src_fd, CHUNK_SIZE)
+                    if not data:
+                        break # The writer went away, reopen and wait for the next one
+                    pending += data
+                    whole = len(pending) - len(pending) % TS_PACKET_SIZE
+                    chunk, pending = pending[:whole], pending[whole:]
+                    if chunk:
+                        self._publish(chunk)
+            finally:
+                os.close(src_fd)
+
+    def _publish(self, chunk):
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.put_nowait(chunk)
+                except queue.Full:
+                    print("[INFO] Dropping a client that can't keep up")
+                    self.clients.discard(client)
+                    try:
+                        while True:
+                            client.get_nowait() # Make room for the disconnect marker
+                    except queue.Empty:
+                        pass
+                    client.put_nowait(None) # Tells the handler to disconnect; only this thread puts
+
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+def get_broadcaster(path):
+    with _broadcasters_lock:
+        if path not in _broadcasters:
+            _broadcasters[path] = FifoBroadcaster(path)
+        return _broadcasters[path]
 
 class StreamHandler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -19,23 +94,46 @@ class StreamHandler(BaseHTTPRequestHandler):
             while not os.path.exists(PIPE_FILE):
                 print("[INFO] Waiting for pipe to appear...")
                 time.sleep(0.5)    
-            try:
-                with open(PIPE_FILE, 'rb', buffering=0) as f:
-                    while True:
-                        print("[INFO] Waiting for stream data…")
-                        chunk = f.read(1316)  # 7 MPEG-TS packets
-                        print(f"[INFO] Read {len(chunk)} bytes")
-                        if chunk:
-                            self.wfile.write(chunk)
-                        else:
-                            time.sleep(0.01)                            
-            except BrokenPipeError:
-                print("[INFO] Client disconnected")
-            except Exception as e:
-                print(f"[ERROR] Streaming exception: {e}")
+            if stat.S_ISFIFO(os.stat(PIPE_FILE).st_mode):
+                self._stream_fifo()
+            else:
+                self._stream_file()
         else:
             self.send_cors_error(404)
             
+    def _stream_file(self):
+        # A regular file has an offset per open, so every client can read it independently.
+        # sendfile copies it to the socket inside the kernel, so the stream never passes through Python.
+        src_fd = os.open(PIPE_FILE, os.O_RDONLY)
+        try:
+            sock_fd = self.connection.fileno()
+            while True:
+                if not os.sendfile(sock_fd, src_fd, None, CHUNK_SIZE):
+                    time.sleep(0.005) # No new data yet
+        except (BrokenPipeError, ConnectionResetError):
+            print("[INFO] Client disconnected")
+        except Exception as e:
+            print(f"[ERROR] Streaming exception: {e}")
+        finally:
+            os.close(src_fd)
+
+    def _stream_fifo(self):
+        # A FIFO can only be consumed once, so all clients share one reader and get copies of its chunks
+        broadcaster = get_broadcaster(PIPE_FILE)
+        client = broadcaster.subscribe()
+        try:
+            while True:
+                chunk = client.get()
+                if chunk is None:
+                    break
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            print("[INFO] Client disconnected")
+        except Exception as e:
+            print(f"[ERROR] Streaming exception: {e}")
+        finally:
+            broadcaster.unsubscribe(client)
+
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -54,6 +152,9 @@ class StreamHandler(BaseHTTPRequestHandler):
 
 
 if __name__ == '__main__':
-    httpd = HTTPServer(('0.0.0.0', PORT), StreamHandler)
+    # Each client streams on its own thread, so one viewer doesn't block everyone else.
+    # Viewers of a FIFO all share the single FifoBroadcaster reader.
+    httpd = ThreadingHTTPServer(('0.0.0.0', PORT), StreamHandler)
+    httpd.daemon_threads = True
     print(f"[INFO] Stream server started on port {PORT}")
     httpd.serve_forever()